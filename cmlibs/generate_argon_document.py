@@ -1,6 +1,15 @@
-import copy
+import argparse
+import glob
+import gzip
+import hashlib
 import json
+import mmap
 import os
+import re
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 
 DIR_1 = '/Users/hsor001/Projects/musculoskeletal/workflows/sparc/data/argon_viewer_out'
 DIR_2 = '/Users/hsor001/Projects/musculoskeletal/data/vickie_shim_6f1/'
@@ -83,111 +92,691 @@ EMPTY_REGION = {
 
 SKIP_REGIONS = ['maxilla', ]
 
+# Rules are regular expressions searched for in the path of the first node file of a region
+# relative to the common path of the data, when several rules set the same property the last
+# one listed wins.
+DEFAULT_RULES = {
+    "graphics_templates": {
+        "surfaces": SCENE_GRAPHICS["Scene"]["Graphics"],
+    },
+    "default_graphics": "surfaces",
+    "rules": [
+        {"pattern": "MUSCLES", "material": "muscle"},
+        {"pattern": "NECK", "material": "muscle"},
+        {"pattern": "BONE", "material": "bone"},
+        {"pattern": "LIGAMENT", "material": "white"},
+        {"pattern": "SKIN", "material": "brown"},
+        *({"pattern": f"/(?i:{re.escape(name)})/[^/]+$", "skip": True} for name in SKIP_REGIONS),
+    ],
+}
 
-def main():
-    os.walk(DIR_2)
-    data_files = []
-    for root, dirs, files in os.walk(DIR_2, topdown=True):
-        current_dir = {
-            'node_files': [],
-            'elem_files': []
+NODE_FILE_EXTENSION = '.exnode'
+ELEM_FILE_EXTENSION = '.exelem'
+CRAWL_WORKERS = 8
+# Bump when the way headers are read or data blocks are counted changes.
+HEADER_CACHE_VERSION = 2
+
+
+def _new_region(name=None):
+    # Only the mutable parts of the template are copied.
+    region = {**EMPTY_REGION, "Scene": {**EMPTY_REGION["Scene"]}}
+    if name is not None:
+        region["Name"] = name
+
+    return region
+
+
+def _new_scene(graphics_template, material=None):
+    graphics_list = []
+    for graphics in graphics_template:
+        # Only the mutable parts of the template are copied.
+        graphics = {key: dict(value) if isinstance(value, dict) else value for key, value in graphics.items()}
+        if material is not None:
+            graphics["Material"] = material
+        graphics_list.append(graphics)
+
+    return {**SCENE_GRAPHICS["Scene"], "Graphics": graphics_list}
+
+
+class RegionRules:
+    """
+    The material, graphics and skip rules compiled into a single regular expression.
+    Each rule is an optional lookahead from the start of the region path, so one match
+    finds every rule matching anywhere in the path, even where their matches overlap.
+    Matching rules are applied in the order listed, so the last matching rule wins.
+    """
+
+    def __init__(self, rules):
+        self._graphics_templates = rules["graphics_templates"]
+        self._default_graphics = rules["default_graphics"]
+        # Identifies the rules in the incremental manifest, a document built with other rules is rebuilt.
+        self.fingerprint = hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+        self._rules = [{key: value for key, value in rule.items() if key != "pattern"} for rule in rules["rules"]]
+        self._pattern = re.compile(''.join(f'(?=.*?(?P<rule{index}>{rule["pattern"]}))?'
+                                           for index, rule in enumerate(rules["rules"])), re.DOTALL)
+
+    def match(self, region_path):
+        """
+        Returns the graphics template, material and whether to skip the region with the given path.
+        """
+        properties = {"graphics": self._default_graphics, "material": None, "skip": False}
+        m = self._pattern.match(region_path)
+        for index, rule_properties in enumerate(self._rules):
+            if m.start(f'rule{index}') != -1:
+                properties.update(rule_properties)
+
+        return self._graphics_templates[properties["graphics"]], properties["material"], properties["skip"]
+
+    @classmethod
+    def from_file(cls, rules_file):
+        with open(rules_file) as f:
+            rules = json.load(f)
+
+        return cls({**DEFAULT_RULES, **rules})
+
+
+class RegionNode:
+    """
+    A region of the Argon document along with a lookup of its child regions by name.
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self._children = {}
+
+    def child(self, name):
+        node = self._children.get(name)
+        if node is None:
+            node = RegionNode(_new_region(name))
+            self.region.setdefault("ChildRegions", []).append(node.region)
+            self._children[name] = node
+
+        return node
+
+    def descendant(self, names):
+        node = self
+        for name in names:
+            node = node.child(name)
+
+        return node
+
+    def find(self, names):
+        node = self
+        for name in names:
+            node = node._children.get(name)
+            if node is None:
+                break
+
+        return node
+
+    def prune(self):
+        """
+        Remove child regions that have neither graphics, a model nor child regions of their own.
+        """
+        for name, node in list(self._children.items()):
+            node.prune()
+            if node.region["Scene"]["Graphics"] is None and "Model" not in node.region and not node.region.get("ChildRegions"):
+                self.region["ChildRegions"].remove(node.region)
+                del self._children[name]
+
+        if "ChildRegions" in self.region and not self.region["ChildRegions"]:
+            del self.region["ChildRegions"]
+
+    def sort_children(self, order, path=()):
+        """
+        Sort child regions by their rank in order, keyed by the tuple of region names from the root.
+        """
+        if self.region.get("ChildRegions"):
+            self.region["ChildRegions"].sort(key=lambda region: order.get(path + (region["Name"],), len(order)))
+        for name, node in self._children.items():
+            node.sort_children(order, path + (name,))
+
+    @classmethod
+    def from_region(cls, region):
+        node = cls(region)
+        for child_region in region.get("ChildRegions", []):
+            node._children[child_region["Name"]] = cls.from_region(child_region)
+
+        return node
+
+
+_FIELD_LINE = re.compile(r'^\s*\d+\)\s*(?P<name>[^,]+),\s*(?P<type>[^,]+),\s*(?P<coordinate_system>[^,#]+?)\s*,[^#]*#Components=(?P<count>\d+)')
+# Component lines look like 'x.  Value index= 1' or 'x.  l.Lagrange*l.Lagrange, ...', lines
+# such as '1.  #Values=1' and 'Value indices:' in element headers are not components.
+_COMPONENT_LINE = re.compile(r'^\s*(?P<name>[^.#:]+?)\.(?!\s*#)(?:\s|$)')
+# Line and face entries, 'Element: 0 0 N' or 'Element: 0 N 0', can come before the element
+# field header so only an element with a non-zero first index starts the element data.
+_DATA_BLOCK = re.compile(rb'^\s*(?:Node:|Element:[ \t]*0*[1-9])', re.MULTILINE)
+_NODE_MARKER = re.compile(rb'Node:')
+_ELEMENT_MARKER = re.compile(rb'Element:[ \t]*0*[1-9]')
+
+
+def _read_header(filename):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            match = _DATA_BLOCK.search(m)
+            return m[:match.start() if match else len(m)].decode('utf-8', 'replace')
+
+
+def read_header_fields(filename):
+    """
+    Read the fields defined in the leading header of an EXNODE/EXELEM file, the file is
+    memory mapped and nothing after the first node or element data block is read, line and
+    face entries listed before the elements are read through.
+    """
+    fields = []
+    component_names = None
+    count = 0
+    for line in _read_header(filename).splitlines():
+        field_match = _FIELD_LINE.match(line)
+        if field_match:
+            count = int(field_match.group('count'))
+            component_names = []
+            fields.append({
+                "CoordinateSystemType": field_match.group('coordinate_system').strip().upper().replace(' ', '_'),
+                "FieldFiniteElement": {
+                    "ComponentNames": component_names,
+                    "NumberOfComponents": count
+                },
+                "IsManaged": True,
+                "IsTypeCoordinate": field_match.group('type').strip() == 'coordinate',
+                "Name": field_match.group('name').strip(),
+            })
+        elif component_names is not None and len(component_names) < count:
+            component_match = _COMPONENT_LINE.match(line)
+            if component_match:
+                component_names.append(component_match.group('name'))
+
+    return fields
+
+
+def count_data_blocks(filename):
+    """
+    Count the nodes or elements in a data file by counting 'Node:' or 'Element:' markers,
+    the file is read in chunks without being parsed.  Line and face entries listed as
+    'Element: 0 0 N' or 'Element: 0 N 0' are not counted as elements.
+    """
+    marker = _ELEMENT_MARKER if filename.lower().endswith(ELEM_FILE_EXTENSION) else _NODE_MARKER
+    count = 0
+    tail = b''
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            # Only whole lines are counted, so a marker split across chunks is counted once.
+            block = tail + chunk
+            end = block.rfind(b'\n') + 1
+            count += len(marker.findall(block, 0, end))
+            tail = block[end:]
+    count += len(marker.findall(tail))
+
+    return count
+
+
+class HeaderIndex:
+    """
+    Fields read from the headers of data files and their node or element counts, cached in
+    a JSON file against the modification time and size of each file so unchanged files are
+    not read again.
+    """
+
+    def __init__(self, cache_file):
+        self._cache_file = cache_file
+        self._previous = {}
+        self._entries = {}
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
+            if cache.get("version") == HEADER_CACHE_VERSION:
+                self._previous = cache["files"]
+
+    def _entry(self, filename, file_stat):
+        entry = self._entries.get(filename)
+        if entry is None:
+            entry = self._previous.get(filename)
+            if entry is None or entry["stat"] != file_stat:
+                entry = {"stat": file_stat}
+            self._entries[filename] = entry
+
+        return entry
+
+    def fields(self, filename, file_stat):
+        entry = self._entry(filename, file_stat)
+        if "fields" not in entry:
+            entry["fields"] = read_header_fields(filename)
+
+        return entry["fields"]
+
+    def data_count(self, filename, file_stat):
+        entry = self._entry(filename, file_stat)
+        if "count" not in entry:
+            entry["count"] = count_data_blocks(filename)
+
+        return entry["count"]
+
+    def region_fields(self, data):
+        """
+        The fields of all the files of a region, the first definition of a field is used.
+        """
+        fields = {}
+        for filename in data['node_files'] + data['elem_files']:
+            for field in self.fields(filename, data['file_stats'][filename]):
+                fields.setdefault(field["Name"], field)
+
+        return list(fields.values())
+
+    def save(self, data_files):
+        # Entries for files that are no longer part of the data, or have changed, are dropped.
+        entries = {}
+        for data in data_files:
+            for filename, file_stat in data['file_stats'].items():
+                entry = self._entries.get(filename, self._previous.get(filename))
+                if entry is not None and entry["stat"] == file_stat:
+                    entries[filename] = entry
+        with open(self._cache_file, 'w') as f:
+            json.dump({"version": HEADER_CACHE_VERSION, "files": entries}, f)
+
+
+def _source_statistics(data_files, headers):
+    statistics = {}
+    for data in data_files:
+        for filename, file_stat in data['file_stats'].items():
+            count = headers.data_count(filename, file_stat)
+            is_elem_file = filename in data['elem_files']
+            statistics[filename] = {
+                "Bytes": file_stat[1],
+                "Nodes": 0 if is_elem_file else count,
+                "Elements": count if is_elem_file else 0,
+                "IsElementFile": is_elem_file,
+            }
+
+    return statistics
+
+
+def schedule_region_loading(region, statistics):
+    """
+    Order the sources of each region smallest first, keeping node files before element
+    files, and the child regions of each region by their total size, so small regions
+    are loaded first.  Each region is given a 'LoadCost' hint of the bytes, nodes and
+    elements in the region and its child regions.
+    Returns the load cost of the region.
+    """
+    cost = {"Bytes": 0, "Nodes": 0, "Elements": 0}
+    sources = region.get("Model", {}).get("Sources", [])
+    sources.sort(key=lambda source: (statistics[source["FileName"]]["IsElementFile"], statistics[source["FileName"]]["Bytes"]))
+    for source in sources:
+        for key in cost:
+            cost[key] += statistics[source["FileName"]][key]
+
+    child_costs = []
+    for child_region in region.get("ChildRegions", []):
+        child_cost = schedule_region_loading(child_region, statistics)
+        child_costs.append((child_cost["Bytes"], len(child_costs), child_region))
+        for key in cost:
+            cost[key] += child_cost[key]
+    if child_costs:
+        region["ChildRegions"] = [child_region for _, _, child_region in sorted(child_costs)]
+
+    region["LoadCost"] = cost
+    return cost
+
+
+def _scan_directory(directory):
+    node_files = []
+    elem_files = []
+    file_stats = {}
+    subdirectories = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            # Like os.walk, symbolic links to directories are not followed.
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file():
+                extension = os.path.splitext(entry.name)[1].lower()
+                if extension == NODE_FILE_EXTENSION:
+                    node_files.append(entry.path)
+                elif extension == ELEM_FILE_EXTENSION:
+                    elem_files.append(entry.path)
+                else:
+                    continue
+                stat = entry.stat()
+                file_stats[entry.path] = [stat.st_mtime_ns, stat.st_size]
+
+    current_dir = {
+        'directory': directory,
+        'node_files': sorted(node_files),
+        'elem_files': sorted(elem_files),
+        'file_stats': file_stats,
+    }
+    return current_dir, subdirectories
+
+
+def crawl_data_files(directory, max_workers=CRAWL_WORKERS):
+    """
+    Scan the directory tree with a pool of threads, each directory is scanned as its own task,
+    yielding the node and element files of each directory that has node files as soon as
+    that directory has been scanned.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_directory, directory)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                current_dir, subdirectories = future.result()
+                pending.update(executor.submit(_scan_directory, subdirectory) for subdirectory in subdirectories)
+                if len(current_dir["node_files"]):
+                    yield current_dir
+
+
+def _common_path(data_files):
+    return os.path.commonpath([d["node_files"][0] for d in data_files])
+
+
+def _region_parts(data, common_path):
+    region_path = data["node_files"][0].replace(common_path, '')
+    region_parts = region_path.split('/')
+    region_parts.pop(0)
+    return region_path, region_parts
+
+
+def _add_data_to_region(root, data, common_path, rules, headers=None):
+    region_path, region_parts = _region_parts(data, common_path)
+    base_region = root.descendant(part.lower() for part in region_parts[:-1]).region
+
+    graphics_template, material, skip = rules.match(region_path)
+    if skip:
+        base_region["Scene"] = _new_scene(graphics_template)
+        return
+
+    base_region["Scene"] = _new_scene(graphics_template, material)
+    if headers is not None:
+        base_region["Fieldmodule"] = {"Fields": headers.region_fields(data)}
+
+    if "Model" not in base_region:
+        base_region["Model"] = {"Sources": []}
+
+    region_name = os.path.dirname(region_path).lower()
+    for node_file in data['node_files']:
+        exnode_path = node_file  # .replace(common_path, '')[1:]
+        base_region["Model"]["Sources"].insert(
+            0,
+            {
+                "FileName": exnode_path,
+                "RegionName": region_name,
+                "Type": "FILE"
+            }
+        )
+    for elem_file in data['elem_files']:
+        exelem_path = elem_file  # .replace(common_path, '')[1:]
+        base_region["Model"]["Sources"].append(
+            {
+                "FileName": exelem_path,
+                "RegionName": region_name,
+                "Type": "FILE"
+            }
+        )
+
+
+def _clear_region(root, data, common_path):
+    _, region_parts = _region_parts(data, common_path)
+    node = root.find(part.lower() for part in region_parts[:-1])
+    if node is not None:
+        node.region["Fieldmodule"] = EMPTY_REGION["Fieldmodule"]
+        node.region["Scene"] = {**EMPTY_REGION["Scene"]}
+        node.region.pop("Model", None)
+
+
+def _sort_data_files(data_files):
+    # The crawl finishes directories in no particular order, sort them so that the
+    # document is the same from run to run.
+    return sorted(data_files, key=lambda d: d["directory"])
+
+
+def build_region_tree(data_files, rules, headers=None):
+    data_files = _sort_data_files(data_files)
+    common_path = _common_path(data_files)
+
+    root = RegionNode(_new_region())
+    for data in data_files:
+        _add_data_to_region(root, data, common_path, rules, headers)
+
+    return root.region
+
+
+def _manifest_filename(output_file):
+    return output_file + '.manifest'
+
+
+def _create_manifest(data_files, options):
+    return {
+        "common_path": _common_path(data_files),
+        "options": options,
+        "directories": {data["directory"]: data for data in data_files},
+    }
+
+
+def _open_document(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+
+    return open(filename, mode)
+
+
+def _write_json(f, value, indent, separators, level=0):
+    item_separator, key_separator = separators
+    if isinstance(value, (dict, list)) and value:
+        newline = '' if indent is None else '\n' + ' ' * (indent * (level + 1))
+        closing_newline = '' if indent is None else '\n' + ' ' * (indent * level)
+        is_dict = isinstance(value, dict)
+        f.write('{' if is_dict else '[')
+        for index, key in enumerate(sorted(value) if is_dict else range(len(value))):
+            if index:
+                f.write(item_separator)
+            f.write(newline)
+            if is_dict:
+                f.write(json.dumps(key))
+                f.write(key_separator)
+            _write_json(f, value[key], indent, separators, level + 1)
+        f.write(closing_newline)
+        f.write('}' if is_dict else ']')
+    else:
+        f.write(json.dumps(value))
+
+
+def write_argon_document(argon_document, output_file, compact=False):
+    """
+    Write the document with sorted keys depth first directly to the file, the output is
+    the same as json.dumps(..., sort_keys=True) without building the whole document as a string.
+    Files ending in '.gz' are gzip compressed.
+    """
+    indent, separators = (None, (',', ':')) if compact else (2, (',', ': '))
+    with _open_document(output_file, 'w') as f:
+        _write_json(f, argon_document, indent, separators)
+
+
+def _read_incremental_state(output_file):
+    manifest_file = _manifest_filename(output_file)
+    if not (os.path.isfile(output_file) and os.path.isfile(manifest_file)):
+        return None, None
+
+    with _open_document(output_file, 'r') as f:
+        argon_document = json.load(f)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    return argon_document, manifest
+
+
+def update_region_tree(root_region, manifest, data_files, rules, headers=None):
+    """
+    Patch the region tree of an existing document, only the regions of directories
+    whose node or element files have changed since the manifest was written are re-derived.
+    Returns the number of directories that changed.
+    """
+    common_path = manifest["common_path"]
+    previous = manifest["directories"]
+    current = {data["directory"]: data for data in data_files}
+    changed = [directory for directory in previous.keys() | current.keys()
+               if previous.get(directory, {}).get("file_stats") != current.get(directory, {}).get("file_stats")]
+
+    root = RegionNode.from_region(root_region)
+    for directory in changed:
+        if directory in previous:
+            _clear_region(root, previous[directory], common_path)
+    for directory in sorted(changed):
+        if directory in current:
+            _add_data_to_region(root, current[directory], common_path, rules, headers)
+
+    root.prune()
+    # New regions were appended, put them where a full build creates them.
+    order = {}
+    for data in _sort_data_files(data_files):
+        names = tuple(part.lower() for part in _region_parts(data, common_path)[1][:-1])
+        for depth in range(1, len(names) + 1):
+            order.setdefault(names[:depth], len(order))
+    root.sort_children(order)
+    return len(changed)
+
+
+def generate_argon_document(directory, output_file, incremental=False, compact=False, rules=None, schedule=False):
+    if rules is None:
+        rules = RegionRules(DEFAULT_RULES)
+
+    data_files = _sort_data_files(crawl_data_files(directory))
+    headers = HeaderIndex(output_file + '.headers')
+
+    # Options that change the content of the regions, the document is rebuilt when they change.
+    options = {"rules": rules.fingerprint, "schedule": schedule}
+    argon_document, manifest = _read_incremental_state(output_file) if incremental else (None, None)
+    # A change in the common path changes the name of every region.
+    if manifest is not None and manifest.get("options") == options and \
+            manifest["common_path"] == _common_path(data_files):
+        changed_count = update_region_tree(argon_document["RootRegion"], manifest, data_files, rules, headers)
+        print(f"Updated regions for {changed_count} changed directories.")
+    else:
+        argon_document = {
+            **VERSION_INFO
         }
-        for file in files:
-            # print(file)
-            if file.endswith('.EXNODE'):
-                current_dir['node_files'].append(os.path.join(root, file))
-            if file.endswith('.EXELEM'):
-                current_dir['elem_files'].append(os.path.join(root, file))
+        argon_document["RootRegion"] = build_region_tree(data_files, rules, headers)
 
-        if len(current_dir["node_files"]):
-            data_files.append(current_dir)
+    if schedule:
+        schedule_region_loading(argon_document["RootRegion"], _source_statistics(data_files, headers))
 
-    common_path = os.path.commonpath([d["node_files"][0] for d in data_files])
+    write_argon_document(argon_document, output_file, compact)
+    with open(_manifest_filename(output_file), 'w') as f:
+        json.dump(_create_manifest(data_files, options), f)
+    headers.save(data_files)
 
-    argon_document = {
-        **VERSION_INFO
+    return argon_document
+
+
+def _count_regions_and_sources(root_region):
+    region_count = 0
+    source_count = 0
+    regions = [root_region]
+    while regions:
+        region = regions.pop()
+        region_count += 1
+        source_count += len(region.get("Model", {}).get("Sources", []))
+        regions.extend(region.get("ChildRegions", []))
+
+    # The root region is not counted.
+    return region_count - 1, source_count
+
+
+def _generate_dataset(directory, output_file, incremental, compact, rules, schedule):
+    start = time.perf_counter()
+    argon_document = generate_argon_document(directory, output_file, incremental, compact, rules, schedule)
+    region_count, source_count = _count_regions_and_sources(argon_document["RootRegion"])
+    return {
+        "output": output_file,
+        "regions": region_count,
+        "sources": source_count,
+        "time": time.perf_counter() - start,
     }
 
-    root_region = copy.deepcopy(EMPTY_REGION)
-
-    bits = []
-    for index, data in enumerate(data_files):
-
-        exnode_file = data["node_files"][0]
-        region_path = exnode_file.replace(common_path, '')
-
-        region_parts = region_path.split('/')
-        region_parts.pop(0)
-        base_region = root_region
-        for i in range(len(region_parts) - 1):
-            current_region = region_parts[i].lower()
-
-            if "ChildRegions" not in base_region:
-                base_region["ChildRegions"] = []
-
-            child_region_names = []
-            for region_info in base_region["ChildRegions"]:
-                child_region_names.append(region_info["Name"])
-
-            if current_region not in child_region_names:
-                new_child = copy.deepcopy(EMPTY_REGION)
-                new_child['Name'] = current_region
-                base_region["ChildRegions"].append(new_child)
-                child_region_names.append(current_region)
-
-            j = child_region_names.index(current_region)
-
-            base_region = base_region["ChildRegions"][j]
-
-        # base_region["Fieldmodule"] = copy.deepcopy(FIELD_MODULE["Fieldmodule"])
-        base_region["Scene"] = copy.deepcopy(SCENE_GRAPHICS["Scene"])
-        bit = f"'{region_parts[-2].lower()}',"
-        # if bit not in bits:
-        #     bits.append(bit)
-        if region_parts[-2].lower() in SKIP_REGIONS:
-            continue
-
-        if "Model" not in base_region:
-            base_region["Model"] = {"Sources": []}
-
-        for node_file in data['node_files']:
-            exnode_path = node_file  # .replace(common_path, '')[1:]
-            base_region["Model"]["Sources"].insert(
-                0,
-                {
-                    "FileName": exnode_path,
-                    "RegionName": os.path.dirname(region_path).lower(),
-                    "Type": "FILE"
-                }
-            )
-        for elem_file in data['elem_files']:
-            exelem_path = elem_file  # .replace(common_path, '')[1:]
-            base_region["Model"]["Sources"].append(
-                {
-                    "FileName": exelem_path,
-                    "RegionName": os.path.dirname(region_path).lower(),
-                    "Type": "FILE"
-                }
-            )
-
-        if 'MUSCLES' in region_path or 'NECK' in region_path:
-            base_region["Scene"]["Graphics"][0]["Material"] = "muscle"
-        if 'BONE' in region_path:
-            base_region["Scene"]["Graphics"][0]["Material"] = "bone"
-        if 'LIGAMENT' in region_path:
-            base_region["Scene"]["Graphics"][0]["Material"] = "white"
-        if 'SKIN' in region_path:
-            base_region["Scene"]["Graphics"][0]["Material"] = "brown"
-
-    argon_document["RootRegion"] = root_region
-
-    print('\n'.join(bits))
-    with open(os.path.join(DIR_2, 'test_file.json'), 'w') as f:
-        f.write(json.dumps(argon_document, default=lambda o: o.__dict__, sort_keys=True, indent=2))
+
+def generate_argon_documents(directories, output_name, incremental=False, compact=False, rules=None, schedule=False, jobs=None):
+    """
+    Generate an Argon document for each of the directories using a pool of processes,
+    the documents are written into their directory with the given name.
+    Yields the directory and a summary of its document, or the exception raised while
+    generating it, as each dataset finishes.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_generate_dataset, directory, os.path.join(directory, output_name),
+                                   incremental, compact, rules, schedule): directory for directory in directories}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def _expand_directories(patterns):
+    directories = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        directories.extend(os.path.abspath(match) for match in matches if os.path.isdir(match))
+
+    return directories
+
+
+def _process_arguments():
+    parser = argparse.ArgumentParser(description="Generate an Argon document for a tree of EXNODE/EXELEM files.")
+    parser.add_argument("directory", nargs="*", default=[DIR_2],
+                        help="Directory containing the EXNODE/EXELEM files, given more than one directory or a glob"
+                             " pattern a document is generated for each directory.")
+    parser.add_argument("-o", "--output",
+                        help="Output Argon document [default is 'test_file.json' in the input directory], with more"
+                             " than one directory this is the filename of the document written to each directory.")
+    parser.add_argument("-r", "--rules",
+                        help="JSON file of material, graphics and skip rules to use instead of the built in rules.")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only update the regions for directories that changed since the document was last generated.")
+    parser.add_argument("-c", "--compact", action="store_true",
+                        help="Write the document without indentation.")
+    parser.add_argument("-z", "--gzip", action="store_true",
+                        help="Write the document gzip compressed, '.gz' is added to the output filename.")
+    parser.add_argument("-s", "--schedule", action="store_true",
+                        help="Count the nodes and elements in each file, order sources and regions smallest first"
+                             " and add a 'LoadCost' hint to each region.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of datasets to generate at once [default is the number of processors].")
+    return parser.parse_args()
+
+
+def main():
+    args = _process_arguments()
+    rules = RegionRules.from_file(args.rules) if args.rules else RegionRules(DEFAULT_RULES)
+    if len(args.directory) == 1 and not glob.has_magic(args.directory[0]):
+        directory = os.path.abspath(args.directory[0])
+        output_file = args.output if args.output else os.path.join(directory, 'test_file.json')
+        if args.gzip:
+            output_file += '.gz'
+        generate_argon_document(directory, output_file, args.incremental, args.compact, rules, args.schedule)
+        return 0
+
+    directories = _expand_directories(args.directory)
+    output_name = os.path.basename(args.output) if args.output else 'test_file.json'
+    if args.gzip:
+        output_name += '.gz'
+
+    failed = False
+    print(f"{'Regions':>8} {'Sources':>8} {'Time (s)':>9}  Output")
+    results = generate_argon_documents(directories, output_name, args.incremental, args.compact, rules, args.schedule, args.jobs)
+    for directory, result in results:
+        if isinstance(result, Exception):
+            failed = True
+            print(f"Failed to generate a document for '{directory}': {result}")
+        else:
+            print(f"{result['regions']:8d} {result['sources']:8d} {result['time']:9.3f}  {result['output']}")
+
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 model_sources = {
     "Model": {
@@ -2,17 +2,27 @@
 This script takes as an input the directory where the Doxygen xml output is.
 From the files in the directory it will print out an approximate attempt at the text required for binding with emscripten.
 
-- It will *not* deal with overloaded methods.
+- Overloaded methods are bound with select_overload under names disambiguated by their parameters,
+  such as 'removeUnitByIndex', see build_method_index.
 - It will *not* create definitions for constructors.
 
+Class files are parsed in parallel and the extracted classes are cached by the hash of the
+file content in 'extract_cache.json', so only changed class files are parsed again.
+
+With '-e' the bindings in an existing source file or directory are parsed and only the
+'.function'/'.value' entries that are missing or different are written, grouped per class and enum.
+
 usage:
- python extract_emscripten_helper.py <directory-to-doxygen-xml-content>
+ python extract_emscripten_helper.py [-j JOBS] [-e EXISTING_BINDINGS] <directory-to-doxygen-xml-content | combined-doxygen-xml-file>
 """
+import argparse
+import hashlib
 import html
-import mimetypes
+import io
+import json
 import os
 import re
-import sys
+from concurrent.futures import ProcessPoolExecutor
 from os import listdir
 from os.path import isfile, join
 
@@ -25,14 +35,15 @@ NAMES_REQUIRING_NAMESPACE = ["UnitsPtr", "VariablePtr", "ResetPtr", "ComponentPt
 NAMES_REQUIRING_UNITS_QUALIFICATION = ["Prefix", "StandardUnit"]
 NAMES_REQUIRING_VARIABLE_QUALIFICATION = ["InterfaceType"]
 PARAM_NAME_MAP = {"oldUnits": "units", "variable1": "variable"}
-
-
-def set_overload_text(overload):
-    overload_text = ''
-    if overload:
-        overload_text = 'ByXXX'
-
-    return overload_text
+CACHE_FILE = 'extract_cache.json'
+CACHE_VERSION = 2
+QUALIFIED_NAMES = {
+    **{name: f'libcellml::{name}' for name in NAMES_REQUIRING_NAMESPACE},
+    **{name: f'libcellml::Units::{name}' for name in NAMES_REQUIRING_UNITS_QUALIFICATION},
+    **{name: f'libcellml::Variable::{name}' for name in NAMES_REQUIRING_VARIABLE_QUALIFICATION},
+}
+# Names that are already qualified, or are the JavaScript names of enums, are left alone.
+QUALIFIED_NAMES_PATTERN = re.compile(r'(?<![:"])\b(' + '|'.join(QUALIFIED_NAMES) + r')\b')
 
 
 def print_test_header(f, class_name, method_name, overload_text=''):
@@ -75,15 +86,16 @@ def print_pair_test(f, class_name, method_name):
         print_test_footer(f)
 
 
-def print_skeleton_test(f, class_name, method_name, overload):
-    overload_text = set_overload_text(overload)
+def print_skeleton_test(f, class_name, method_name, binding_name=None):
+    binding_name = binding_name or method_name
+    overload_text = binding_name[len(method_name):]
     print_test_header(f, class_name, method_name, overload_text)
     declare_class_variable(f, class_name)
     f.write(f'    expect(x.{method_name}{overload_text}()).toBe("")\n')
     print_test_footer(f)
 
 
-def print_test(f, class_name, method_name, overload=False, is_pair=False):
+def print_test(f, class_name, method_name, binding_name=None, is_pair=False):
     """  test('Checking Model name.', () => {
     const m = new libcellml.Model()
 
@@ -98,7 +110,7 @@ def print_test(f, class_name, method_name, overload=False, is_pair=False):
     elif is_pair:
         print_pair_test(f, class_name, method_name)
     else:
-        print_skeleton_test(f, class_name, method_name, overload)
+        print_skeleton_test(f, class_name, method_name, binding_name)
 
 
 def convert_to_base_method_name(name):
@@ -112,19 +124,97 @@ def convert_to_base_method_name(name):
 def determine_set_get_pairs(methods):
     pairs = {}
     for key in methods:
-        s = key.split('::')
-        function_name = s.pop()
-        lower_method_name = convert_to_base_method_name(function_name)
-        if lower_method_name in pairs:
-            pairs[lower_method_name] += 1
+        lower_method_name = convert_to_base_method_name(key.split('::')[-1])
+        pairs[lower_method_name] = pairs.get(lower_method_name, 0) + 1
+
+    return {name: count for name, count in pairs.items() if count == 2}
+
+
+def _parameter_variation(param):
+    name = PARAM_NAME_MAP.get(param["name"], param["name"])
+    return name[0].upper() + name[1:]
+
+
+def _type_variation(param):
+    words = re.findall(r'[A-Za-z0-9]+', param["type"].split('::')[-1])
+    return ''.join(word[0].upper() + word[1:] for word in words if word != 'const')
+
+
+def _overload_variations(info):
+    """
+    Candidate name suffixes for an overload, from the shortest to the most specific.
+    """
+    params = info["param_list"]
+    if not params:
+        return ['', '', '']
+    by_first = 'By' + _parameter_variation(params[0])
+    by_all = 'By' + 'And'.join(_parameter_variation(p) for p in params)
+    by_types = by_all + 'Of' + 'And'.join(_type_variation(p) for p in params)
+    return [by_first, by_all, by_types]
+
+
+def _name_overloads(function_name, method_information):
+    """
+    Give each overload of a method a unique binding name.
+
+    The first parameter name is used where that is enough to tell the
+    overloads apart, otherwise all the parameter names and then their types.
+    Overloads differing only in const-ness get a Const suffix.
+    """
+    variations = [_overload_variations(info) for info in method_information]
+    level_counts = [{} for _ in range(len(variations[0]))]
+    for candidates in variations:
+        for counts, candidate in zip(level_counts, candidates):
+            counts[candidate] = counts.get(candidate, 0) + 1
+
+    seen = set()
+    overloads = []
+    for candidates, info in zip(variations, method_information):
+        suffix = next((candidate for counts, candidate in zip(level_counts, candidates) if counts[candidate] == 1),
+                      None)
+        if suffix is None:
+            suffix = candidates[-1] + ('Const' if info["const"] else '')
+        unique_suffix = suffix
+        count = 1
+        while unique_suffix in seen:
+            count += 1
+            unique_suffix = f'{suffix}{count}'
+        seen.add(unique_suffix)
+        overloads.append({"binding_name": function_name + unique_suffix, "info": info})
+
+    return overloads
+
+
+def build_method_index(data):
+    """
+    Index the methods of a class once for both the wrapping and the test output.
+
+    Each entry has the method key and name, its set/get base name, whether it
+    is part of a set/get pair and its overloads with their binding names.
+    """
+    set_get_pairs = determine_set_get_pairs(data['methods'])
+    index = []
+    for key, method_information in data['methods'].items():
+        function_name = key.split('::')[-1]
+        base_name = convert_to_base_method_name(function_name)
+        overloaded = len(method_information) > 1
+        if overloaded:
+            overloads = _name_overloads(function_name, method_information)
         else:
-            pairs[lower_method_name] = 1
+            overloads = [{"binding_name": function_name, "info": method_information[0]}]
+        index.append({
+            "key": key,
+            "name": function_name,
+            "base_name": base_name,
+            "is_pair": base_name in set_get_pairs,
+            "overloaded": overloaded,
+            "overloads": overloads,
+        })
 
-    pairs = dict(filter(lambda elem: elem[1] == 2, pairs.items()))
-    return pairs
+    return index
 
 
-def print_test_file(data):
+def print_test_file(f, data, method_index=None):
     """
 const libCellMLModule = require('libcellml.js/libcellml.common')
 let libcellml = null
@@ -135,124 +225,85 @@ describe("Model tests", () => {
     });
 })
     """
-    set_get_pairs = determine_set_get_pairs(data['methods'])
-    visited_pairs = []
+    if method_index is None:
+        method_index = build_method_index(data)
+    visited_pairs = set()
     full_class_name = data['name']
     s = full_class_name.split('::')
     class_name = s.pop()
-    with open('tests.txt', 'a') as f:
-        f.write('\n')
-        f.write("""
+    f.write('\n')
+    f.write("""
 const libCellMLModule = require('libcellml.js/libcellml.common')
 let libcellml = null
 
 """)
-        f.write(f'describe("{class_name} tests", () => {{\n')
-        f.write("""  beforeAll(async () => {
+    f.write(f'describe("{class_name} tests", () => {{\n')
+    f.write("""  beforeAll(async () => {
     libcellml = await libCellMLModule();
   });
 """)
-        for key in data['methods']:
-            s = key.split('::')
-            function_name = s.pop()
-
-            base_function_name = convert_to_base_method_name(function_name)
-            if base_function_name in visited_pairs:
-                continue
-            is_pair = base_function_name in set_get_pairs
-            if is_pair:
-                visited_pairs.append(base_function_name)
-            method_information = data['methods'][key]
-            if len(method_information) == 1:
-                print_test(f, class_name, function_name, is_pair=is_pair)
-            else:
-                for info in method_information:
-                    print_test(f, class_name, function_name, overload=True)
-        f.write('})\n')
-
-
-def add_namespace_to_class():
-    with open('wrapping.txt') as f:
-        content = f.read()
-
-    for name in NAMES_REQUIRING_NAMESPACE:
-        content = re.sub(r'\b' + name + r'\b', f'libcellml::{name}', content)
-        # content = content.replace('\b' + name + '\b', f'libcellml::{name}')
-
-    for name in NAMES_REQUIRING_UNITS_QUALIFICATION:
-        content = re.sub(r'\b' + name + r'\b', f'libcellml::Units::{name}', content)
-        # content = content.replace('\b' + name + '\b', f'libcellml::Units::{name}')
-        # Undo bad replacements
-        # if name == "Prefix":
-        #     content = content.replace("Attributelibcellml::Units::Prefix", "AttributePrefix")
-        # elif name == "StandardUnit":
-        #     content = content.replace("Bylibcellml::Units::StandardUnit", "ByStandardUnit")
-
-    for name in NAMES_REQUIRING_VARIABLE_QUALIFICATION:
-        content = re.sub(r'\b' + name + r'\b', f'libcellml::Variable::{name}', content)
-        # content = content.replace('\b' + name + '\b', f'libcellml::Variable::{name}')
-        # Undo bad replacements
-        # if name == "InterfaceType":
-        #     content = content.replace("setlibcellml::Variable::InterfaceType", "setInterfaceType")
-        #     content = content.replace("Bylibcellml::Variable::InterfaceType", "ByInterfaceType")
-        #     content = content.replace("removelibcellml::Variable::InterfaceType", "removeInterfaceType")
-        #     content = content.replace("haslibcellml::Variable::InterfaceType", "hasInterfaceType")
-        #     content = content.replace("permitslibcellml::Variable::InterfaceType", "permitsInterfaceType")
-
-    with open('wrapping.txt', 'w') as f:
-        f.write(content)
-
-
-def print_class(data):
-    with open('wrapping.txt', 'a') as wrapping_file:
-        wrapping_file.write('\n')
-
-        full_class_name = data['name']
-        s = full_class_name.split('::')
-        class_name = s.pop()
-
-        wrapping_file.write('# include <emscripten/bind.h>\n\n')
-        wrapping_file.write(f'# include "libcellml/{class_name.lower()}.h"\n\n')
-        wrapping_file.write('using namespace emscripten;\n\n')
-        wrapping_file.write(f'EMSCRIPTEN_BINDINGS(libcellml_{class_name.lower()})\n{{\n')
-
-        enums = data['enums']
-        for enum in enums:
-            enum_name = enum['name']
-            wrapping_file.write(f'    enum_<{full_class_name}::{enum_name}>("{enum_name}")\n')
-            for value in enum['values']:
-                wrapping_file.write(f'        .value("{value}", {full_class_name}::{enum_name}::{value})\n')
-            wrapping_file.write('    ;\n\n')
-
-        wrapping_file.write(f'    class_<{full_class_name}>("{class_name}")\n')
-        for key in data['methods']:
-            s = key.split('::')
-            function_name = s.pop()
-            method_information = data['methods'][key]
-            if len(method_information) == 1:
-                wrapping_file.write(f'        .function("{function_name}", &{key})\n')
-            else:
-                for info in method_information:
-                    params = info["param_list"]
-                    const = " const" if info["const"] else ""
-                    if len(params):
-                        first_param_name = params[0]["name"]
-                        if first_param_name in PARAM_NAME_MAP:
-                            first_param_name = PARAM_NAME_MAP[first_param_name]
-                        function_variation = first_param_name[0].upper() + first_param_name[1:]
-                    else:
-                        function_variation = 'XXX'
-                    param_list = ', '.join([p["type"] for p in params])
-                    wrapping_file.write(f'        .function("{function_name}By{function_variation}", select_overload<{info["returns"]}({param_list}){const}>(&{key}))\n')
-
-        wrapping_file.write('    ;\n}\n')
-
-        print_header = True
-        for warning in data['warnings']:
-            if print_header:
-                wrapping_file.write(f'\nWarnings: {class_name}\n')
-                print_header = False
-            wrapping_file.write(f' - {warning}\n')
+    for method in method_index:
+        if method["base_name"] in visited_pairs:
+            continue
+        if method["is_pair"]:
+            visited_pairs.add(method["base_name"])
+        if method["overloaded"]:
+            for overload in method["overloads"]:
+                print_test(f, class_name, method["name"], overload["binding_name"])
+        else:
+            print_test(f, class_name, method["name"], is_pair=method["is_pair"])
+    f.write('})\n')
+
+
+def add_namespace(content):
+    """
+    Qualify the names that need a namespace, all names are replaced in a single pass.
+    """
+    return QUALIFIED_NAMES_PATTERN.sub(lambda m: QUALIFIED_NAMES[m.group(1)], content)
+
+
+def print_class(wrapping_file, data, method_index=None):
+    if method_index is None:
+        method_index = build_method_index(data)
+    wrapping_file.write('\n')
+
+    full_class_name = data['name']
+    s = full_class_name.split('::')
+    class_name = s.pop()
+
+    wrapping_file.write('# include <emscripten/bind.h>\n\n')
+    wrapping_file.write(f'# include "libcellml/{class_name.lower()}.h"\n\n')
+    wrapping_file.write('using namespace emscripten;\n\n')
+    wrapping_file.write(f'EMSCRIPTEN_BINDINGS(libcellml_{class_name.lower()})\n{{\n')
+
+    enums = data['enums']
+    for enum in enums:
+        enum_name = enum['name']
+        wrapping_file.write(f'    enum_<{full_class_name}::{enum_name}>("{enum_name}")\n')
+        for value in enum['values']:
+            wrapping_file.write(f'        .value("{value}", {full_class_name}::{enum_name}::{value})\n')
+        wrapping_file.write('    ;\n\n')
+
+    wrapping_file.write(f'    class_<{full_class_name}>("{class_name}")\n')
+    for method in method_index:
+        key = method["key"]
+        if not method["overloaded"]:
+            wrapping_file.write(f'        .function("{method["name"]}", &{key})\n')
+            continue
+        for overload in method["overloads"]:
+            info = overload["info"]
+            const = " const" if info["const"] else ""
+            param_list = ', '.join([p["type"] for p in info["param_list"]])
+            wrapping_file.write(f'        .function("{overload["binding_name"]}", select_overload<{info["returns"]}({param_list}){const}>(&{key}))\n')
+
+    wrapping_file.write('    ;\n}\n')
+
+    print_header = True
+    for warning in data['warnings']:
+        if print_header:
+            wrapping_file.write(f'\nWarnings: {class_name}\n')
+            print_header = False
+        wrapping_file.write(f' - {warning}\n')
 
 
 def extract_parameters(elements):
@@ -269,83 +320,305 @@ def extract_parameters(elements):
     return params
 
 
-def print_out_near_emscripten_format(source_file):
-    tree = XmlTree.parse(source_file)
-    root = tree.getroot()
-    cs = root.findall("compounddef[@kind='class']")
-    data = {'name': None, 'methods': {}, 'warnings': [], 'enums': []}
-    for c in cs:
-        full_class_name = c.find('./compoundname').text
-        data['name'] = full_class_name
-        es = c.findall("./sectiondef[@kind='public-type']/memberdef[@kind='enum']")
-        for e in es:
-            name = e.find("./name").text
-            value_elements = e.findall("./enumvalue")
-            values = []
-            for value_element in value_elements:
-                values.append(value_element.find("./name").text)
-
-            data['enums'].append({
-                "name": name,
-                "values": values,
+def _add_enum(data, e):
+    name = e.find("./name").text
+    value_elements = e.findall("./enumvalue")
+    values = []
+    for value_element in value_elements:
+        values.append(value_element.find("./name").text)
+
+    data['enums'].append({
+        "name": name,
+        "values": values,
+    })
+
+
+def _add_function(data, f):
+    d = f.find("./briefdescription/para").text
+    if d is None:
+        data['warnings'].append(f'Non standard brief description!!! {f.find("./definition").text}')
+        return
+    r = [True for tt in IGNORE_FUNCTIONS_WITH_BRIEF_DESCRIPTION if d.startswith(tt)]
+    if len(r):
+        data['warnings'].append(f'Function not marked with Doxygen directive @private: {f.find("./definition").text}')
+        return
+    function_definition = f.find("./definition").text
+    return_type = f.find("./type")
+    function_return_type = ''.join([e for e in return_type.itertext()])
+    args_string = f.find("./argsstring").text
+
+    p = function_definition.split(' ')
+    if len(p) > 1:
+        full_definition = p[1]
+        param_elements = f.findall("./param")
+        params = extract_parameters(param_elements)
+        method_object = {
+            "name": full_definition,
+            "returns": function_return_type,
+            "param_list": params,
+            "const": args_string.endswith(" const")
+        }
+        if full_definition in data['methods']:
+            data['methods'][full_definition].append(method_object)
+        else:
+            data['methods'][full_definition] = [method_object]
+
+
+def iter_class_data(source_file):
+    """
+    Stream the libcellml classes out of a Doxygen xml file, which may be a single class file
+    or the combined output of all compounds.  Each compounddef and memberdef is handled
+    when it closes and then cleared, so memory use does not grow with the size of the file.
+    """
+    root = None
+    data = None
+    section_kind = None
+    for event, element in XmlTree.iterparse(source_file, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if root is None:
+                root = element
+            elif tag == 'compounddef':
+                is_class = element.get('kind') == 'class' and element.get('id', '').startswith('classlibcellml_1_1')
+                data = {'name': None, 'methods': {}, 'warnings': [], 'enums': []} if is_class else None
+            elif tag == 'sectiondef':
+                section_kind = element.get('kind')
+        elif data is None:
+            if tag == 'memberdef':
+                element.clear()
+            elif tag == 'compounddef':
+                root.clear()
+        elif tag == 'compoundname':
+            data['name'] = element.text
+        elif tag == 'memberdef':
+            member_kind = element.get('kind')
+            if section_kind == 'public-type' and member_kind == 'enum':
+                _add_enum(data, element)
+            elif section_kind == 'public-func' and member_kind == 'function':
+                _add_function(data, element)
+            element.clear()
+        elif tag == 'sectiondef':
+            section_kind = None
+        elif tag == 'compounddef':
+            yield data
+            data = None
+            root.clear()
+
+
+def extract_file_classes(source_file):
+    return list(iter_class_data(source_file))
+
+
+def _hash_file(source_file):
+    with open(source_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_cache():
+    if os.path.isfile(CACHE_FILE):
+        with open(CACHE_FILE) as f:
+            content = json.load(f)
+        if content.get('version') == CACHE_VERSION:
+            return content['files']
+
+    return {}
+
+
+def extract_classes(source_files, jobs=None):
+    """
+    Extract the class data from each of the source files, files whose content has not
+    changed since the last run are taken from the cache, the rest are parsed in a pool
+    of processes.
+    Returns the class data of all the files sorted by class name.
+    """
+    cache = _read_cache()
+    hashes = {source_file: _hash_file(source_file) for source_file in source_files}
+    changed_files = [source_file for source_file in source_files if hashes[source_file] not in cache]
+    if len(changed_files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            changed_data = list(executor.map(extract_file_classes, changed_files))
+    else:
+        changed_data = [extract_file_classes(source_file) for source_file in changed_files]
+
+    # Only the current class files are kept in the cache.
+    cache = {hashes[source_file]: cache.get(hashes[source_file]) for source_file in source_files}
+    cache.update((hashes[source_file], data) for source_file, data in zip(changed_files, changed_data))
+    with open(CACHE_FILE, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'files': cache}, f)
+
+    classes = [data for source_file in source_files for data in cache[hashes[source_file]]]
+    return sorted(classes, key=lambda data: data['name'] or '')
+
+
+_BINDINGS_TOKEN = re.compile(r'\b(?P<kind>class_|enum_)<(?P<type>(?:[^<>]|<[^<>]*>)*)>\s*\(\s*"(?P<name>[\w.]+)"\s*\)'
+                             r'|\.(?P<entry>function|value)\(\s*"(?P<entry_name>\w+)"\s*,'
+                             r'|(?P<end>;)')
+# The bound C++ type is the first template argument, 'class_<T, base<B>>' binds T.
+_BOUND_TYPE = re.compile(r'\s*((?:[^,<>]|<[^<>]*>)+)')
+_COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+
+
+def _closing_parenthesis(text, start):
+    """
+    Position of the parenthesis closing the call whose arguments start at start.
+    """
+    depth = 1
+    quote = None
+    for position in range(start, len(text)):
+        c = text[position]
+        if quote:
+            if c == quote and text[position - 1] != '\\':
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return position
+
+    return len(text)
+
+
+def _normalise_binding(text):
+    text = re.sub(r'\s+', ' ', text.strip())
+    return re.sub(r' ?([^\w ]) ?', r'\1', text)
+
+
+def parse_bindings(text):
+    """
+    Read the class_ and enum_ declarations of EMSCRIPTEN_BINDINGS blocks.
+
+    Returns a dict keyed by (kind, bound C++ type), each with the declaration
+    text and a dict of its .function/.value entries by name, holding the entry
+    text and its whitespace normalised target.
+    """
+    text = _COMMENT.sub(' ', text)
+    bindings = {}
+    current = None
+    match = _BINDINGS_TOKEN.search(text)
+    while match:
+        position = match.end()
+        if match.group('kind'):
+            bound_type = _normalise_binding(_BOUND_TYPE.match(match.group('type')).group(1))
+            current = bindings.setdefault((match.group('kind'), bound_type), {
+                "declaration": match.group(0),
+                "entries": {},
             })
+        elif match.group('end'):
+            current = None
+        elif current is not None:
+            end = _closing_parenthesis(text, match.end())
+            entry = text[match.start():end + 1]
+            current["entries"][match.group('entry_name')] = {
+                "text": re.sub(r'\s+', ' ', entry),
+                "target": _normalise_binding(text[match.end():end]),
+            }
+            # Skip over the entry so a ';' inside it, in a lambda say, does not end the declaration.
+            position = end + 1
+        match = _BINDINGS_TOKEN.search(text, position)
+
+    return bindings
+
+
+def read_existing_bindings(path):
+    """
+    Parse the bindings from a source file or a directory of source files.
+    """
+    if os.path.isdir(path):
+        source_files = sorted(join(root, f) for root, _, files in os.walk(path) for f in files
+                              if f.endswith(('.cpp', '.cc', '.h')))
+    else:
+        source_files = [path]
+
+    bindings = {}
+    for source_file in source_files:
+        with open(source_file, encoding='utf-8', errors='replace') as f:
+            for key, binding in parse_bindings(f.read()).items():
+                existing = bindings.setdefault(key, binding)
+                if existing is not binding:
+                    existing["entries"].update(binding["entries"])
+
+    return bindings
+
 
-        fs = c.findall("./sectiondef[@kind='public-func']/memberdef[@kind='function']")
-        for f in fs:
-            d = f.find("./briefdescription/para").text
-            if d is None:
-                data['warnings'].append(f'Non standard brief description!!! {f.find("./definition").text}')
-                continue
-            r = [True for tt in IGNORE_FUNCTIONS_WITH_BRIEF_DESCRIPTION if d.startswith(tt)]
-            if len(r):
-                data['warnings'].append(f'Function not marked with Doxygen directive @private: {f.find("./definition").text}')
-                continue
-            function_definition = f.find("./definition").text
-            return_type = f.find("./type")
-            function_return_type = ''.join([e for e in return_type.itertext()])
-            args_string = f.find("./argsstring").text
-
-            p = function_definition.split(' ')
-            if len(p) > 1:
-                full_definition = p[1]
-                param_elements = f.findall("./param")
-                params = extract_parameters(param_elements)
-                method_object = {
-                    "name": full_definition,
-                    "returns": function_return_type,
-                    "param_list": params,
-                    "const": args_string.endswith(" const")
-                }
-                if full_definition in data['methods']:
-                    data['methods'][full_definition].append(method_object)
-                else:
-                    data['methods'][full_definition] = [method_object]
-
-    print_class(data)
-    print_test_file(data)
-
-
-def process_file(source_file):
-    if os.path.exists(source_file):
-        result = mimetypes.guess_type(source_file)
-        if len(result) > 1 and result[0] == 'application/xml':
-            print_out_near_emscripten_format(source_file)
+def print_binding_drift(f, generated, existing):
+    """
+    Write the generated entries that are missing from, or differ from, the existing bindings.
+    """
+    for key, binding in generated.items():
+        kind, name = key
+        current = existing.get(key)
+        if current is None:
+            lines = [f'        {entry["text"]}' for entry in binding["entries"].values()]
+            note = 'missing'
+        else:
+            lines = []
+            for entry_name, entry in binding["entries"].items():
+                current_entry = current["entries"].get(entry_name)
+                if current_entry is None:
+                    lines.append(f'        {entry["text"]}  // missing')
+                elif current_entry["target"] != entry["target"]:
+                    lines.append(f'        {entry["text"]}  // changed from: {current_entry["text"]}')
+            note = 'drift'
+        if current is None or lines:
+            f.write(f'\n// {note}: {kind} {name}\n    {binding["declaration"]}\n')
+            for line in lines:
+                f.write(f'{line}\n')
+            f.write('    ;\n')
+
+
+def _is_xml_file(source_file):
+    return source_file.endswith('.xml') and isfile(source_file)
+
+
+def _process_arguments():
+    parser = argparse.ArgumentParser(description="Print an approximation of the emscripten bindings for the libcellml"
+                                                 " classes documented in Doxygen xml output.")
+    parser.add_argument("source",
+                        help="Directory of Doxygen xml output, or a single xml file of combined Doxygen output.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of processes used to parse class files [default is the number of processors].")
+    parser.add_argument("-e", "--existing",
+                        help="Existing bindings source file or directory, only the entries missing from or"
+                             " differing from these bindings are written to wrapping.txt.")
+    return parser.parse_args()
 
 
 def main():
-    args = sys.argv[:]
-
-    source_dir = args.pop()
-    if os.path.exists(source_dir) and os.path.isdir(source_dir):
-        with open('wrapping.txt', 'w'):
-            pass
-        with open('tests.txt', 'w'):
-            pass
-        dir_files = [join(source_dir, f) for f in listdir(source_dir) if isfile(join(source_dir, f)) and f.startswith('classlibcellml_1_1')]
-        for f in dir_files:
-            process_file(f)
-
-        add_namespace_to_class()
+    args = _process_arguments()
+
+    source = args.source
+    if _is_xml_file(source):
+        source_files = [source]
+    elif os.path.isdir(source):
+        dir_files = [join(source, f) for f in listdir(source) if f.startswith('classlibcellml_1_1')]
+        source_files = [f for f in dir_files if _is_xml_file(f)]
+    else:
+        source_files = None
+
+    existing = read_existing_bindings(args.existing) if args.existing else None
+
+    if source_files is not None:
+        wrapping_parts = []
+        tests_file = io.StringIO()
+        for data in extract_classes(source_files, args.jobs):
+            method_index = build_method_index(data)
+            class_wrapping = io.StringIO()
+            print_class(class_wrapping, data, method_index)
+            wrapping = add_namespace(class_wrapping.getvalue())
+            if existing is not None:
+                drift = io.StringIO()
+                print_binding_drift(drift, parse_bindings(wrapping), existing)
+                wrapping = drift.getvalue()
+            wrapping_parts.append(wrapping)
+            print_test_file(tests_file, data, method_index)
+
+        with open('wrapping.txt', 'w') as f:
+            f.write(''.join(wrapping_parts))
+        with open('tests.txt', 'w') as f:
+            f.write(tests_file.getvalue())
 
 
 if __name__ == "__main__":
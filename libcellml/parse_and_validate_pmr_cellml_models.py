@@ -1,80 +1,591 @@
 #!/usr/bin/env python
 
 import argparse
-import filecmp
+import hashlib
+import itertools
 import json
 import os
+import queue
 import re
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import requests
+from requests.adapters import HTTPAdapter
 
 here = os.path.abspath(os.path.dirname(__file__))
 
+DOWNLOAD_MANIFEST = "download_manifest.jsonl"
+HTTP_CACHE_INDEX = "http_cache.json"
+VALIDATION_CACHE_INDEX = "validation_cache.json"
+
+_local_filename_locks = defaultdict(threading.Lock)
+_local_filename_locks_guard = threading.Lock()
+
+
+class _JsonIndex:
+    """
+    Thread safe dictionary persisted as a JSON file.
+    Only entries whose key passes 'keep' are loaded from an existing file.
+    """
+
+    def __init__(self, index_file, keep=None):
+        self._index_file = index_file
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(index_file):
+            with open(index_file) as f:
+                self._entries = {key: value for key, value in json.load(f).items() if keep is None or keep(key)}
+
+    def get(self, url):
+        with self._lock:
+            return self._entries.get(url)
+
+    def set(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+
+    def save(self):
+        with self._lock:
+            content = json.dumps(self._entries, indent=1, sort_keys=True)
+        with open(self._index_file + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(self._index_file + ".tmp", self._index_file)
+
+
+def _hash_content(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _hash_file(filename):
+    with open(filename, "rb") as f:
+        return _hash_content(f.read())
+
+
+TIMEOUT_RESULT = "timeout"
+
+
+def _max_rss_kb(usage):
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux.
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def _run_instrumented(executable, model_files, timeout=None):
+    """
+    Run the validator directly, without a shell, on one or more models recording the
+    wall time, CPU time and peak RSS of the run.
+    If the validator runs for longer than 'timeout' seconds it is killed and the result
+    is reported as a timeout.
+    """
+    timed_out = threading.Event()
+    reaped = False
+    lock = threading.Lock()
+    start = time.monotonic()
+    # Start a new session so that the validator and anything it starts can be killed together.
+    process = subprocess.Popen([executable, *model_files], start_new_session=True)
+
+    def _kill():
+        with lock:
+            if reaped:
+                return
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+                timed_out.set()
+            except ProcessLookupError:
+                pass
+
+    timer = threading.Timer(timeout, _kill) if timeout else None
+    if timer is not None:
+        timer.start()
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    finally:
+        with lock:
+            reaped = True
+        if timer is not None:
+            timer.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # A validator that exited on its own just as the timer fired has not timed out.
+    killed = timed_out.is_set() and process.returncode == -signal.SIGKILL
+
+    return {
+        "return_code": TIMEOUT_RESULT if killed else process.returncode,
+        "wall_time": time.monotonic() - start,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "max_rss_kb": _max_rss_kb(usage),
+    }
+
+
+def run_cellml_model(executable, model_file, timeout=None):
+    return _run_instrumented(executable, [model_file], timeout)["return_code"]
+
+
+class _ValidationCache(_JsonIndex):
+    """
+    Validation return codes keyed on the content of both the validator and the model.
+    Only the model file itself is hashed, not the models it imports, and only the
+    validator executable, not the libraries it is linked against.  Files such as the
+    libcellml shared library can be added to the key with 'key_files'.
+    """
+
+    def __init__(self, index_file, executable, key_files=()):
+        validator_hash = _hash_file(executable)
+        if key_files:
+            validator_hash = _hash_content("".join([validator_hash, *(_hash_file(f) for f in key_files)]).encode())
+        self._key_prefix = f"{validator_hash}:"
+        # Results from any other build of the validator are dropped.
+        super().__init__(index_file, keep=lambda key: key.startswith(self._key_prefix))
+
+    def key(self, model_file):
+        return self._key_prefix + _hash_file(model_file)
+
+
+def _run_batch(executable, model_files, timeout=None):
+    """
+    Run the validator on a batch of models.  A batch that fails is split in half and
+    each half run again, so the models that pass are still validated in batches and
+    only the failing models end up being run by themselves.
+    """
+    if len(model_files) == 1:
+        return [{"model": model_files[0], **_run_instrumented(executable, model_files, timeout)}]
+
+    # The timeout is per model, so scale it for the batch.
+    batch_record = _run_instrumented(executable, model_files, timeout * len(model_files) if timeout else None)
+    if batch_record["return_code"] == 0:
+        # The timings are for the whole batch, not for each model.
+        return [{"model": model_file, "batch_size": len(model_files), **batch_record} for model_file in model_files]
+
+    middle = len(model_files) // 2
+    return _run_batch(executable, model_files[:middle], timeout) + _run_batch(executable, model_files[middle:], timeout)
+
+
+def _validate_batch(executable, model_files, validation_cache=None, timeout=None):
+    if validation_cache is None:
+        return _run_batch(executable, model_files, timeout)
+
+    records = []
+    keys = {}
+    for model_file in model_files:
+        key = validation_cache.key(model_file)
+        result = validation_cache.get(key)
+        if result is None:
+            keys[model_file] = key
+        else:
+            records.append({"model": model_file, "return_code": result, "cached": True})
+
+    if keys:
+        for record in _run_batch(executable, list(keys), timeout):
+            # A timeout depends on the limit given for this run, so is not worth remembering.
+            if record["return_code"] != TIMEOUT_RESULT:
+                validation_cache.set(keys[record["model"]], record["return_code"])
+            records.append(record)
+
+    return records
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def _pop_completed(pending):
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        yield pending.pop(future), future.result()
+
+
+def _imap_unordered(executor, fn, iterable, limit):
+    """
+    Like Executor.map but with at most 'limit' tasks submitted at a time, so the iterable
+    is consumed lazily, and yielding (item, result) pairs in the order they complete.
+    """
+    pending = {}
+    for item in iterable:
+        if len(pending) >= limit:
+            yield from _pop_completed(pending)
+        pending[executor.submit(fn, item)] = item
+
+    while pending:
+        yield from _pop_completed(pending)
+
+
+def _pipeline(iterable, maxsize):
+    """
+    Consume the iterable in a producer thread through a bounded queue, so the
+    producer keeps working while the consumer handles the items already produced.
+    """
+    items = queue.Queue(maxsize)
+    finished = object()
+    errors = []
+
+    def _produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            items.put(finished)
+
+    producer = threading.Thread(name="PipelineProducerThread", target=_produce, daemon=True)
+    producer.start()
+    item = items.get()
+    while item is not finished:
+        yield item
+        item = items.get()
+    producer.join()
+    if errors:
+        raise errors[0]
 
-def run_cellml_model(executable, model_file):
-    return_code = subprocess.call(f"{executable} {model_file}", shell=True)
-    return return_code
+
+def _validate_models(executable, model_files, jobs=1, validation_cache=None, timeout=None, batch_size=1):
+    # The pool threads only wait on the validator processes, so up to 'jobs'
+    # validators run at once without the GIL getting in the way.
+    batches = _batched(model_files, max(batch_size, 1))
+    if jobs < 2:
+        for batch in batches:
+            yield from _validate_batch(executable, batch, validation_cache, timeout)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for _, records in _imap_unordered(executor, lambda batch: _validate_batch(executable, batch, validation_cache, timeout),
+                                          batches, jobs):
+            yield from records
+
+
+def _print_slowest_models(records, count):
+    print(f"{'Wall (s)':>10} {'CPU (s)':>10} {'RSS (kB)':>10}  Model")
+    for record in records[:count]:
+        print(f"{record['wall_time']:10.3f} {record['cpu_time']:10.3f} {record['max_rss_kb']:10d}  {record['model']}")
+
+
+def _walk_model_files(directory):
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for name in files:
+            yield os.path.join(root, name)
+
+
+_PMR_URL_PREFIX = re.compile('https?://[^/]+/(?:e|exposure)/[^/]+/')
+_VIEW_SUFFIX = re.compile('/view$')
 
 
 def _get_local_filename(model_url):
-    filename = re.sub('https://models.physiomeproject.org/e/[^/]+/', '', model_url)
-    filename = re.sub('https://models.physiomeproject.org/exposure/[^/]+/', '', filename)
+    # Any host is accepted so that a local stand-in for PMR can be used.
+    filename = _PMR_URL_PREFIX.sub('', model_url)
     # with open('filenames.txt', 'a') as f:
     #     f.write(f"{filename}\n")
 
     return filename
 
 
-def _get_duplicate_filename(filename):
-    dup = 1
-    dup_filename = f"{filename}_dup{dup}"
-    while os.path.isfile(dup_filename):
-        dup += 1
-        dup_filename = f"{filename}_dup{dup}"
+class _LocalFileIndex:
+    """
+    In memory record of the files under a directory, built with a single walk, so that
+    existing files and the next free duplicate filename can be found without probing
+    the filesystem for every model.
+    """
+
+    def __init__(self, directory):
+        self._files = {os.path.relpath(filename, directory) for filename in _walk_model_files(directory)}
+        self._next_dup = {}
+        self._lock = threading.Lock()
+
+    def exists(self, filename):
+        with self._lock:
+            return os.path.normpath(filename) in self._files
+
+    def add(self, filename):
+        with self._lock:
+            self._files.add(os.path.normpath(filename))
+
+    def reserve_duplicate_filename(self, filename):
+        filename = os.path.normpath(filename)
+        with self._lock:
+            dup = self._next_dup.get(filename, 1)
+            while f"{filename}_dup{dup}" in self._files:
+                dup += 1
+            self._next_dup[filename] = dup + 1
+            dup_filename = f"{filename}_dup{dup}"
+            self._files.add(dup_filename)
+
+        return dup_filename
+
+
+def _local_filename_lock(filename):
+    with _local_filename_locks_guard:
+        return _local_filename_locks[filename]
 
-    return dup_filename
 
+def _conditional_headers(entry, local_files):
+    headers = {}
+    if entry is not None and local_files.exists(entry["filename"]):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
 
-def _do_download_file(url, filename):
+    return headers
+
+
+def _write_file(filename, content):
     directory = os.path.dirname(filename)
     if directory:
         os.makedirs(directory, exist_ok=True)
-    with requests.get(url, stream=True) as r:
+    with open(filename, 'wb') as f:
+        f.write(content)
+
+
+def _download_file(url, local_files, session=requests, cache=None):
+    local_filename = _get_local_filename(url)
+    entry = cache.get(url) if cache is not None else None
+
+    with session.get(url, headers=_conditional_headers(entry, local_files)) as r:
+        if r.status_code == 304:
+            return entry["filename"]
         try:
             r.raise_for_status()
-            with open(filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    # If you have chunk encoded response uncomment if
-                    # and set chunk_size parameter to None.
-                    # if chunked:
-                    f.write(chunk)
         except requests.exceptions.HTTPError:
-            pass
+            return None
+        content = r.content
+        validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+    content_hash = _hash_content(content)
+    # Different URLs can map onto the same local file, only let one of them at a time
+    # decide whether it is a duplicate.
+    with _local_filename_lock(local_filename):
+        if entry is not None and local_files.exists(entry["filename"]):
+            filename = entry["filename"]
+            if entry["sha256"] != content_hash:
+                _write_file(filename, content)
+        elif not local_files.exists(local_filename):
+            filename = local_filename
+            _write_file(filename, content)
+            local_files.add(filename)
+        elif _hash_file(local_filename) == content_hash:
+            filename = local_filename
+        else:
+            filename = local_files.reserve_duplicate_filename(local_filename)
+            _write_file(filename, content)
 
+    if cache is not None:
+        cache.set(url, {"filename": filename, "sha256": content_hash, **validators})
+
+    return filename
 
-def _download_file(url):
-    local_filename = _get_local_filename(url)
 
-    # NOTE the stream=True parameter below
-    if os.path.isfile(local_filename):
-        dup_local_filename = _get_duplicate_filename(local_filename)
-        _do_download_file(url, dup_local_filename)
+def fetch_cellml_model(model_href_raw, session=requests, cache=None, local_files=None):
+    if local_files is None:
+        local_files = _LocalFileIndex(os.curdir)
+    model_href = _VIEW_SUFFIX.sub('', model_href_raw)
+    return _download_file(model_href, local_files, session, cache)
+
+
+def _create_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _read_download_manifest(manifest_file):
+    fetched = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if entry["filename"] is not None:
+                        fetched[entry["href"]] = entry["filename"]
+                except (ValueError, KeyError):
+                    # A partially written last line from an interrupted run.
+                    pass
+
+    return fetched
+
+
+def _download_models(hrefs, manifest_file, jobs=1, cache=None):
+    """
+    Download models with at most 'jobs' requests in flight over one pooled session,
+    yielding local filenames as downloads complete.  Completed downloads are recorded
+    in the manifest so an interrupted run can resume without fetching them again, their
+    local filenames are still yielded.  Failed downloads are not recorded, so they are
+    tried again on resume.  The manifest is removed once every link has been tried, links
+    that fail are tried again by the next run like every other model.
+    With a cache, models already present locally are only fetched again if they changed.
+    """
+    fetched = _read_download_manifest(manifest_file)
+    if fetched:
+        print(f"Resuming download, skipping {len(fetched)} models already fetched.")
+
+    local_files = _LocalFileIndex(os.curdir)
+    failed_count = 0
+
+    def _fetch(href_):
+        if href_ in fetched:
+            return fetched[href_]
+        return fetch_cellml_model(href_, session, cache, local_files)
+
+    with _create_session(jobs) as session, \
+            open(manifest_file, "a") as manifest, \
+            ThreadPoolExecutor(max_workers=jobs) as executor:
         try:
-            if filecmp.cmp(local_filename, dup_local_filename, shallow=False):
-                os.remove(dup_local_filename)
-        except FileNotFoundError:
-            print(f"Trying to compare '{local_filename}' to '{dup_local_filename}' but one of these files wasn't found.")
-    else:
-        _do_download_file(url, local_filename)
+            for href, local_filename in _imap_unordered(executor, _fetch, hrefs, jobs):
+                if local_filename is None:
+                    failed_count += 1
+                elif href not in fetched:
+                    manifest.write(json.dumps({"href": href, "filename": local_filename}) + "\n")
+                    manifest.flush()
+                yield local_filename
+        finally:
+            if cache is not None:
+                cache.save()
+
+    # Only a manifest left by an interrupted run is resumed from.
+    os.remove(manifest_file)
+    if failed_count:
+        print(f"{failed_count} models could not be downloaded.")
+
+
+class _JsonStream:
+    """
+    Minimal pull parser for reading a large JSON document from a file a chunk at a time.
+    Containers are walked with iter_object/iter_array, everything else is decoded with value.
+    """
+
+    _whitespace = re.compile(r'\s*')
+
+    def __init__(self, f, chunk_size=65536):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self._pos = self._whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, characters):
+        c = self._peek()
+        if c not in characters:
+            raise ValueError(f"Expected one of '{characters}' but found '{c}' while streaming JSON.")
+        self._pos += 1
+        return c
+
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at, or split at its fraction or exponent near, the end of the buffer
+            # may continue in the next chunk.
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    (end == len(self._buffer) or self._buffer[end] in '.eE+-') and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _iter_container(self, start, end, item):
+        self._expect(start)
+        if self._peek() == end:
+            self._pos += 1
+            return
+        while True:
+            yield item()
+            if self._expect(',' + end) == end:
+                return
+
+    def iter_array(self):
+        """
+        Yield once for each element of an array, the caller must consume the element.
+        """
+        return self._iter_container('[', ']', lambda: None)
+
+    def iter_object(self):
+        """
+        Yield the key of each member of an object, the caller must consume the value.
+        """
+        def _key():
+            key = self.value()
+            self._expect(':')
+            return key
+
+        return self._iter_container('{', '}', _key)
+
+    def skip(self):
+        c = self._peek()
+        if c == '[':
+            for _ in self.iter_array():
+                self.skip()
+        elif c == '{':
+            for _ in self.iter_object():
+                self.skip()
+        else:
+            self.value()
+
+
+def _iter_hrefs(stream):
+    for _ in stream.iter_array():
+        yield stream.value()["href"]
+
+
+def _collection_links(stream):
+    """
+    Advance the stream to the start of the collection.links array of a PMR listing.
+    Returns an iterator over the link hrefs or None if the listing has no links.
+    """
+    for key in stream.iter_object():
+        if key != "collection":
+            stream.skip()
+            continue
+        for collection_key in stream.iter_object():
+            if collection_key == "links":
+                return _iter_hrefs(stream)
+            stream.skip()
 
-    return local_filename
+    return None
 
 
-def fetch_cellml_model(model_href_raw):
-    model_href = re.sub('/view$', '', model_href_raw)
-    return _download_file(model_href)
+def _read_model_list(list_file, directory):
+    with open(list_file) as f:
+        for line in f:
+            yield os.path.join(directory, line.rstrip())
+
+
+def _unique_model_files(filenames, directory):
+    # Links that failed to download have no file and identical models shared by
+    # several links only need validating once.
+    seen = set()
+    for filename in filenames:
+        if filename is not None and filename not in seen:
+            seen.add(filename)
+            yield os.path.join(directory, filename)
 
 
 def _process_arguments():
@@ -84,69 +595,111 @@ def _process_arguments():
     parser.add_argument("parse_validate_exe",
                         help="Parse and validate executable.")
     parser.add_argument("-d", "--do-download", action="store_true", help="Download files from data file.")
+    parser.add_argument("--download-jobs", type=int, default=4,
+                        help="Maximum number of downloads in flight at once [default is 4].")
+    parser.add_argument("-p", "--pipeline", action="store_true",
+                        help="Validate models as they are downloaded rather than validating the whole local"
+                             " collection after downloading.")
     parser.add_argument("-j", "--just-issues", action="store_true", help="Just report on issues.")
+    parser.add_argument("-n", "--jobs", type=int, default=1,
+                        help="Number of validator processes to run concurrently [default is 1].")
+    parser.add_argument("-c", "--cache-results", action="store_true",
+                        help="Reuse validation results for models and validator that are unchanged since the last run."
+                             " Libraries the validator is linked against are not checked, see --cache-key-file.")
+    parser.add_argument("-k", "--cache-key-file", action="append", default=[],
+                        help="A file, such as the libcellml shared library, whose content is part of the validator's"
+                             " identity for --cache-results. May be given more than once.")
+    parser.add_argument("-t", "--timeout", type=float,
+                        help="Kill the validator if it runs on a model for longer than this many seconds.")
+    parser.add_argument("-r", "--report",
+                        help="Write a JSON lines report with the timing and peak memory of every validator run.")
+    parser.add_argument("-s", "--slowest", type=int, default=0,
+                        help="Print a table of the given number of slowest models.")
+    parser.add_argument("-b", "--batch-size", type=int, default=1,
+                        help="Pass up to this many models to each validator invocation, the validator must accept"
+                             " multiple model files. Failing batches are split in half and run again, so this"
+                             " pays off when most models pass [default is 1].")
     return parser.parse_args()
 
 
-def main():
-    args = _process_arguments()
-    with open(args.data) as f:
-        content = json.load(f)
+def _process_models(args, hrefs):
+    current_dir = os.path.abspath(os.path.curdir)
+    cellml_files_dir = os.path.join(current_dir, "cellml_files")
+    if not os.path.isdir(cellml_files_dir):
+        os.mkdir(cellml_files_dir)
 
-    if "collection" in content and "links" in content["collection"]:
+    executable = args.parse_validate_exe
+    if not os.path.isabs(executable):
+        executable = os.path.join(current_dir, executable)
 
-        current_dir = os.path.abspath(os.path.curdir)
-        cellml_files_dir = os.path.join(current_dir, "cellml_files")
-        if not os.path.isdir(cellml_files_dir):
-            os.mkdir(cellml_files_dir)
+    report_file = os.path.abspath(args.report) if args.report else os.devnull
 
-        executable = args.parse_validate_exe
-        if not os.path.isabs(executable):
-            executable = os.path.join(current_dir, executable)
+    os.chdir(cellml_files_dir)
 
-        os.chdir(cellml_files_dir)
+    summary = {"model_count": 0}
 
-        summary = {"model_count": 0}
+    def _add_result_to_summary(result_):
+        summary["model_count"] += 1
+        result_string = f"{result_}"
+        if result_string not in summary:
+            summary[result_string] = 1
+        else:
+            summary[result_string] += 1
+
+    if args.do_download:
+        manifest_file = os.path.join(current_dir, DOWNLOAD_MANIFEST)
+        cache = _JsonIndex(os.path.join(current_dir, HTTP_CACHE_INDEX))
+        downloaded_files = _download_models(hrefs, manifest_file, args.download_jobs, cache)
+        if not args.pipeline:
+            for _ in downloaded_files:
+                pass
+
+    if args.do_download and args.pipeline:
+        queue_size = 2 * max(args.jobs, args.download_jobs)
+        model_files = _unique_model_files(_pipeline(downloaded_files, queue_size), cellml_files_dir)
+    elif args.just_issues:
+        model_files = _read_model_list(os.path.join(current_dir, 'just_issues.txt'), cellml_files_dir)
+    else:
+        model_files = _walk_model_files(cellml_files_dir)
 
-        links = content["collection"]["links"]
-        if args.do_download:
-            for index, link in enumerate(links):
-                fetch_cellml_model(link["href"])
+    validation_cache = None
+    if args.cache_results:
+        key_files = [os.path.join(current_dir, f) for f in args.cache_key_file]
+        validation_cache = _ValidationCache(os.path.join(current_dir, VALIDATION_CACHE_INDEX), executable, key_files)
 
-        def _add_result_to_summary(result_):
-            summary["model_count"] += 1
-            result_string = f"{result_}"
-            if result_string not in summary:
-                summary[result_string] = 1
-            else:
-                summary[result_string] += 1
+    timed_records = []
+    with open(report_file, "w") as report:
+        records = _validate_models(executable, model_files, args.jobs, validation_cache, args.timeout, args.batch_size)
+        for record in records:
+            _add_result_to_summary(record["return_code"])
+            report.write(json.dumps(record) + "\n")
+            # A batch only has timings for all of its models together.
+            if "wall_time" in record and "batch_size" not in record:
+                timed_records.append(record)
 
-        index = 0
-        if args.just_issues:
-            with open('../just_issues.txt') as f:
-                lines = f.readlines()
+    if validation_cache is not None:
+        validation_cache.save()
 
-            for line in lines:
-                cellml_model_file = line.rstrip()
-                result = run_cellml_model(executable, os.path.join(cellml_files_dir, cellml_model_file))
-                _add_result_to_summary(result)
-        else:
-            for root, dirs, files in os.walk(".", topdown=False):
-                for name in files:
-                    cellml_model_file = os.path.join(root, name)
-                    # result = 0
-                    result = run_cellml_model(executable, os.path.join(cellml_files_dir, cellml_model_file))
-                    _add_result_to_summary(result)
-                    index += 1
-                    # if index > 20:
-                    #     break
-
-        os.chdir(current_dir)
-        with open("summary.json", "w") as f:
-            json.dump(summary, f)
+    if args.slowest > 0:
+        if args.batch_size > 1:
+            print("Models validated in a batch that passed are not timed individually and are left out.")
+        timed_records.sort(key=lambda r: r["wall_time"], reverse=True)
+        _print_slowest_models(timed_records, args.slowest)
 
-    else:
-        return 1
+    os.chdir(current_dir)
+    with open("summary.json", "w") as f:
+        json.dump(summary, f)
+
+
+def main():
+    args = _process_arguments()
+    # The listing is streamed, links are downloaded as they are read.
+    with open(args.data) as f:
+        hrefs = _collection_links(_JsonStream(f))
+        if hrefs is None:
+            return 1
+
+        _process_models(args, hrefs)
 
     return 0
 
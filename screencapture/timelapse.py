@@ -3,19 +3,28 @@
 import os
 import sys
 import time
+import shlex
+import shutil
+import hashlib
+import signal
 import argparse
+import selectors
 
-from queue import Queue, Empty
-from threading import Thread
-from subprocess import Popen
+from subprocess import Popen, DEVNULL, PIPE
+
+DEFAULT_CAPTURE_COMMAND = 'screencapture -x -l {window_id} {output}'
+FRAME_NAME = 'screenshot-{count:05}.png'
+# Fraction of the interval a capture may start after its scheduled time before it is reported as late.
+LATE_TOLERANCE = 0.1
 
 
 def process_argument():
     parser = argparse.ArgumentParser(description="Take a time lapse of an application window using 'screencapture'"
-                                                 " (macOS only). To stop capturing enter the 'q' key to quit.")
+                                                 " (macOS) or another capture command. To stop capturing enter the"
+                                                 " 'q' key to quit.")
     parser.add_argument("-w", "--window-id",
                         help="Id of the window to capture.")
-    parser.add_argument("-i", "--interval", type=int, default=5,
+    parser.add_argument("-i", "--interval", type=float, default=5,
                         help="Interval in seconds between captures [default is 5].")
     parser.add_argument("-o", "--output",
                         help="The output directory for the captured images.")
@@ -23,51 +32,287 @@ def process_argument():
                         help="Max capture time in seconds [default is 3600].")
     parser.add_argument("-s", "--stop-marker", default='q',
                         help="Key to enter to stop program [default key is 'q'].")
+    parser.add_argument("-C", "--capture-command", default=DEFAULT_CAPTURE_COMMAND,
+                        help="Command used to capture a frame, '{output}' is replaced by the image file and"
+                             " '{window_id}' by the window id [default is '%(default)s'].")
+    parser.add_argument("-m", "--max-in-flight", type=int, default=2,
+                        help="Max number of capture commands running at once, frames are skipped while"
+                             " at this limit [default is 2].")
+    parser.add_argument("-e", "--encode",
+                        help="Video file to encode the frames into with ffmpeg as they are captured, the"
+                             " frames are removed once encoded unless --keep-frames is given.")
+    parser.add_argument("--frame-rate", type=float, default=30,
+                        help="Frame rate of the encoded video [default is 30].")
+    parser.add_argument("--scale", type=int,
+                        help="Width in pixels to scale the encoded video down to, keeping the aspect ratio.")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Leave out frames identical to the previous frame from the encoded video.")
+    parser.add_argument("--keep-frames", action="store_true",
+                        help="Keep the captured images when encoding a video.")
+    parser.add_argument("--ffmpeg", default='ffmpeg',
+                        help="The ffmpeg executable used for encoding [default is 'ffmpeg'].")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="Add debugging output.")
 
     return parser
 
 
-def capture_screen(q, options):
-    count = 0
-    finished = False
-    while not finished:
+class FrameEncoder:
+    """
+    Stream captured frames, in capture order, into an ffmpeg process encoding the video.
+    """
+
+    def __init__(self, options):
+        self._options = options
+        command = [options["ffmpeg"], '-loglevel', 'error', '-y', '-f', 'image2pipe',
+                   '-framerate', str(options["frame_rate"]), '-i', '-']
+        if options["scale"]:
+            command.extend(['-vf', f'scale={options["scale"]}:-2'])
+        command.extend(['-pix_fmt', 'yuv420p', options["encode"]])
+        # As for the captures, a session of its own keeps Ctrl-C from stopping the encoder before
+        # the last frames are written.
+        self._process = Popen(command, stdin=PIPE, stdout=DEVNULL, start_new_session=True)
+        self._next = 1
+        self._pending = {}
+        self._last_digest = None
+        self.encoded = 0
+        self.duplicates = 0
+
+    def add(self, count, frame_file, captured):
+        """
+        Queue a finished capture, frames are encoded once all earlier captures have finished.
+        """
+        self._pending[count] = frame_file if captured else None
+        while self._next in self._pending:
+            frame_file = self._pending.pop(self._next)
+            self._next += 1
+            if frame_file is not None:
+                self._encode(frame_file)
+
+    def _encode(self, frame_file):
+        if self._process.stdin is None:
+            # The encoder has exited, the frame is left on disk.
+            return
+
+        try:
+            with open(frame_file, 'rb') as f:
+                frame = f.read()
+        except OSError as e:
+            print(f'Could not read {frame_file}: {e}')
+            return
+
+        digest = hashlib.sha1(frame).digest()
+        if self._options["dedup"] and digest == self._last_digest:
+            self.duplicates += 1
+        else:
+            try:
+                self._process.stdin.write(frame)
+                self.encoded += 1
+            except BrokenPipeError:
+                print('Encoder exited, keeping the remaining frames.')
+                self._process.stdin = None
+                return
+        self._last_digest = digest
+
+        if not self._options["keep_frames"]:
+            os.remove(frame_file)
+
+    def close(self):
+        if self._process.stdin is not None:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._process.stdin = None
+        return_code = self._process.wait()
+        if return_code != 0:
+            print(f'Encoding {self._options["encode"]} failed with exit code {return_code}.')
+        elif self._options["verbose"]:
+            print(f'Encoded {self.encoded} frame(s) into {self._options["encode"]},'
+                  f' {self.duplicates} duplicate(s) left out.')
+
+
+class CaptureScheduler:
+    """
+    Start capture commands at fixed times on the monotonic clock, so the
+    interval does not drift with the time taken to start each capture.
+    """
+
+    def __init__(self, options, start=None, encoder=None):
+        self._options = options
+        self._encoder = encoder
+        self._interval = options["interval"]
+        self._start = time.monotonic() if start is None else start
+        self._tick = 0
+        self._count = 0
+        self._in_flight = []
+        self.failed = 0
+        self.late = 0
+        self.skipped = 0
+
+    def deadline(self):
+        return self._start + (self._tick + 1) * self._interval
+
+    def capture_command(self, frame_file):
+        return [part.format(output=frame_file, window_id=self._options["window_id"])
+                for part in shlex.split(self._options["capture_command"])]
+
+    def tick(self):
+        """
+        Start the capture due now, catching up with the schedule if ticks were missed.
+        """
+        now = time.monotonic()
+        self.reap()
+        lateness = now - self.deadline()
+        missed = int(lateness // self._interval)
+        self._tick += 1 + missed
+        if missed:
+            self.skipped += missed
+            print(f'Capture is {lateness:.2f}s behind schedule, skipped {missed} frame(s).')
+        elif lateness > LATE_TOLERANCE * self._interval:
+            self.late += 1
+            print(f'Capture started {lateness:.2f}s late.')
+
+        if len(self._in_flight) >= self._options["max_in_flight"]:
+            self.skipped += 1
+            print(f'{len(self._in_flight)} captures still running, skipped a frame.')
+            return
+
+        self._count += 1
+        frame_file = os.path.join(self._options["output"], FRAME_NAME.format(count=self._count))
+        try:
+            # A session of its own keeps Ctrl-C from stopping captures that are still running.
+            process = Popen(self.capture_command(frame_file), stdin=DEVNULL, start_new_session=True)
+        except OSError as e:
+            self._finished(self._count, frame_file, False)
+            print(f'Capture of {frame_file} failed: {e}')
+            return
+
+        self._in_flight.append((process, self._count, frame_file))
+        if self._options["verbose"]:
+            print(f'Capturing {frame_file}')
+
+    def reap(self, wait=False):
+        """
+        Collect the finished capture commands and report any that failed.
+        """
+        running = []
+        for process, count, frame_file in self._in_flight:
+            return_code = process.wait() if wait else process.poll()
+            if return_code is None:
+                running.append((process, count, frame_file))
+                continue
+
+            self._finished(count, frame_file, return_code == 0)
+            if return_code != 0:
+                print(f'Capture of {frame_file} failed with exit code {return_code}.')
+        self._in_flight = running
+
+    def _finished(self, count, frame_file, captured):
+        if not captured:
+            self.failed += 1
+        if self._encoder is not None:
+            self._encoder.add(count, frame_file, captured)
+
+    def finish(self):
+        self.reap(wait=True)
+        if self._encoder is not None:
+            self._encoder.close()
+        if self._options["verbose"] or self.failed or self.late or self.skipped:
+            print(f'Captured {self._count - self.failed} frame(s), {self.failed} failed,'
+                  f' {self.late} late, {self.skipped} skipped.')
+
+
+def _read_stop_marker(fd, buffer, options):
+    """
+    Read the available input, returns True when a line matching the stop marker was entered
+    and None when the input is closed.
+    """
+    chunk = os.read(fd, 1024)
+    if not chunk:
+        return None
+
+    buffer.extend(chunk)
+    *lines, remainder = buffer.split(b'\n')
+    buffer[:] = remainder
+    return any(line.decode(errors='replace').rstrip('\r') == options["stop_marker"] for line in lines)
 
+
+def capture_screen(options):
+    """
+    Run the time lapse in a single loop waiting on the input, signals, the next
+    capture and the max capture time together.
+    """
+    encoder = FrameEncoder(options) if options["encode"] else None
+    start = time.monotonic()
+    stop_at = start + options["max_capture"]
+    scheduler = CaptureScheduler(options, start, encoder)
+
+    selector = selectors.DefaultSelector()
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    selector.register(wakeup_read, selectors.EVENT_READ, 'signal')
+    stdin_fd = sys.stdin.fileno() if sys.stdin is not None else None
+    if stdin_fd is not None:
         try:
-            item = q.get(block=True, timeout=options["interval"])
-            q.task_done()
-            if item == "quit":
-                print('quitting')
-                finished = True
+            selector.register(stdin_fd, selectors.EVENT_READ, 'input')
+        except (OSError, ValueError):
+            # Input that cannot be waited on, such as a regular file, is not watched for the stop marker.
+            stdin_fd = None
 
-        except Empty:
-            count += 1
-            Popen(['screencapture', '-x', '-l', options["window_id"],
-                   os.path.join(options["output"], f'screenshot-{count:05}.png')])
+    previous_wakeup_fd = signal.set_wakeup_fd(wakeup_write)
+    previous_handlers = {signum: signal.signal(signum, lambda *_: None)
+                         for signum in (signal.SIGINT, signal.SIGTERM)}
 
+    input_buffer = bytearray()
+    reason = None
+    try:
+        while reason is None:
+            now = time.monotonic()
+            if now >= stop_at:
+                reason = 'max capture time reached'
+                break
 
-def input_watcher(q, options):
-    finished = False
-    while not finished:
-        key = input("")
-        if key == options["stop_marker"]:
-            q.put("quit")
-            finished = True
+            for key, _ in selector.select(min(scheduler.deadline(), stop_at) - now):
+                if key.data == 'signal':
+                    signals = os.read(wakeup_read, 64)
+                    reason = f'received {signal.Signals(signals[-1]).name}'
+                else:
+                    stop = _read_stop_marker(stdin_fd, input_buffer, options)
+                    if stop is None:
+                        selector.unregister(stdin_fd)
+                    elif stop:
+                        reason = 'stop marker entered'
 
+            now = time.monotonic()
+            if reason is None and scheduler.deadline() <= now < stop_at:
+                scheduler.tick()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        signal.set_wakeup_fd(previous_wakeup_fd)
+        selector.close()
+        os.close(wakeup_read)
+        os.close(wakeup_write)
 
-def timeout_watcher(q, options):
-    finished = False
-    start_epoch = time.time()
-    while not finished:
-        time.sleep(0.25)
-        if (time.time() - start_epoch) > options["max_capture"]:
-            q.put("quit")
-            finished = True
+    print('quitting')
+    if options["verbose"]:
+        print(f'Stopped: {reason}.')
+    scheduler.finish()
 
 
 def valid_args(args):
-    if args.output is None or args.interval is None or args.window_id is None:
+    if args.output is None or args.interval is None or args.interval <= 0:
+        return False
+
+    if args.window_id is None and '{window_id}' in args.capture_command:
+        return False
+
+    if args.max_in_flight < 1:
+        return False
+
+    if args.encode and (shutil.which(args.ffmpeg) is None or (args.scale is not None and args.scale < 1)):
         return False
 
     if not os.path.isdir(args.output):
@@ -81,35 +326,21 @@ def main():
     args = parser.parse_args()
 
     if args.verbose:
-        print('Interval: ' + (args.interval if args.interval is not None else 'not set'))
+        print('Interval: ' + (str(args.interval) if args.interval is not None else 'not set'))
         print('Output: ' + (args.output if args.output is not None else 'not set'))
         print('Window id: ' + (args.window_id if args.window_id is not None else 'not set'))
+        print('Capture command: ' + args.capture_command)
 
     if not valid_args(args):
         return 1
 
-    q = Queue()
     options = {'max_capture': args.max_capture, 'output': args.output,
                'window_id': args.window_id, 'interval': args.interval,
-               'stop_marker': args.stop_marker}
-    capture_thread = Thread(name="CaptureScreenThread",
-                            target=capture_screen,
-                            args=(q, options, ))
-    input_thread = Thread(name="InputThread",
-                          target=input_watcher,
-                          daemon=True,
-                          args=(q, options, ))
-    timeout_thread = Thread(name="TimeoutThread",
-                            target=timeout_watcher,
-                            daemon=True,
-                            args=(q, options, ))
-    capture_thread.start()
-    input_thread.start()
-    timeout_thread.start()
-
-    q.join()
-    # input_thread.join()
-    capture_thread.join()
+               'stop_marker': args.stop_marker, 'capture_command': args.capture_command,
+               'max_in_flight': args.max_in_flight, 'verbose': args.verbose,
+               'encode': args.encode, 'frame_rate': args.frame_rate, 'scale': args.scale,
+               'dedup': args.dedup, 'keep_frames': args.keep_frames, 'ffmpeg': args.ffmpeg}
+    capture_screen(options)
 
     return 0
 